@@ -1,19 +1,83 @@
+import asyncio
+import base64
+import hashlib
+import heapq
+import hmac
+import json
+import os
+import queue
 import secrets
+import threading
+import time
+import anyio
 import bcrypt
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from datetime import date
 from enum import Enum
 from typing import Any, Dict, List, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, status
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPBearer
 from pydantic import BaseModel
 
 # Database configuration
 DB_NAME = "ecommerce.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# Read-only connections used by the GET endpoints
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+
+# Sync endpoints run on AnyIO's worker threads (40 by default). A request
+# only takes a thread once it holds a pooled connection (waiting for one
+# happens on the event loop), so this limit is independent of the pool sizes.
+THREADPOOL_SIZE = os.getenv("THREADPOOL_SIZE")
+
+# Per-connection settings applied when a pooled connection is opened.
+# journal_mode=WAL is persistent in the database file and is set in init_db().
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -20000",
+    # Read pages straight from a shared memory map instead of copying them
+    # into each connection's private cache
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+)
+
+# Bump whenever the DDL in init_db() changes so existing databases pick it up
+SCHEMA_VERSION = 7
+
+# Oldest SQLite library the queries run on: INSERT/DELETE ... RETURNING needs
+# 3.35 (UPDATE ... FROM needs 3.33)
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# Size of each connection's prepared-statement cache (sqlite3 default: 128)
+SQLITE_CACHED_STATEMENTS = 512
+
+# Pagination for list endpoints
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
 # Security
-security = HTTPBearer()
+# Bearer tokens are HS256-signed JWTs checked without touching the database.
+# SECRET_KEY is required (the app refuses to start without it): every worker
+# process and every restart must sign with the same key, or tokens issued by
+# one of them are rejected by the others.
+SECRET_KEY = os.getenv("SECRET_KEY", "").encode("utf-8")
+TOKEN_TTL = int(os.getenv("TOKEN_TTL", "3600"))
+
+# bcrypt work factor; each +1 doubles the cost. Aim for roughly 250 ms per
+# hash on the production hardware and raise it as hardware gets faster.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "11"))
+
+# Password hashing and checking run on a dedicated pool sized to the CPU
+# count. bcrypt releases the GIL, so threads hash in parallel on real cores,
+# and a burst of registrations or logins cannot tie up more cores than exist.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
 
 # --- Enums ---
 
@@ -136,344 +200,629 @@ class OrderCreate(BaseModel):
     payment_method: str
 
 
+# SET fragments for the partial-update endpoints, keyed by model field; field
+# names match the column names
+CATEGORY_UPDATE_SQL = {field: f"{field} = ?" for field in CategoryUpdate.model_fields}
+SHOP_UPDATE_SQL = {field: f"{field} = ?" for field in ShopCreate.model_fields}
+PRODUCT_UPDATE_SQL = {field: f"{field} = ?" for field in ProductUpdate.model_fields}
+
+
 # --- Database Initialization ---
 
 
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
-    # Return rows as dictionary-like objects
-    conn.row_factory = sqlite3.Row
+def dict_row(cursor: sqlite3.Cursor, row: tuple) -> Dict[str, Any]:
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+def open_connection(database: str, read_only: bool = False) -> sqlite3.Connection:
+    # Connections are handed between FastAPI's worker threads by the pool
+    conn = sqlite3.connect(
+        f"file:{database}?mode=ro" if read_only else database,
+        uri=read_only,
+        check_same_thread=False,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+    )
+    # Return rows as plain dicts, ready to be returned from handlers
+    conn.row_factory = dict_row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    if read_only:
+        conn.execute("PRAGMA query_only = 1")
     return conn
 
 
+class ConnectionPool:
+    """Fixed set of long-lived connections reused across requests, so the
+    page cache and connection setup are not thrown away on every call.
+
+    Waiting for a free connection happens on the event loop: a request that
+    is queued for a connection must not hold one of AnyIO's worker threads,
+    or the requests that already have a connection can be left without a
+    thread to finish on and never give it back. Must be created inside the
+    running event loop."""
+
+    def __init__(self, database: str, size: int, read_only: bool = False):
+        self._read_only = read_only
+        self._available = anyio.Semaphore(size)
+        self._connections: queue.Queue = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(open_connection(database, read_only))
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        # Never hand out a connection with a half-finished transaction,
+        # e.g. when a handler raised between a write and its commit.
+        if conn.in_transaction:
+            conn.rollback()
+        self._connections.put(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a connection for the duration of an async with block."""
+        async with self._available:
+            # Holding the semaphore guarantees a connection is queued
+            conn = self._connections.get_nowait()
+            try:
+                yield conn
+            finally:
+                self._release(conn)
+
+    def close(self) -> None:
+        while not self._connections.empty():
+            conn = self._connections.get_nowait()
+            # Let SQLite refresh the statistics of tables whose queries on
+            # this connection would benefit, as recommended before closing.
+            # Read-only connections cannot write the results.
+            if not self._read_only:
+                conn.execute("PRAGMA optimize")
+            conn.close()
+
+
+async def get_db(request: Request):
+    async with request.app.state.pool.connection() as conn:
+        yield conn
+
+
+async def get_read_db(request: Request):
+    """Connection for endpoints that only read. In WAL mode these read from
+    their own snapshot and never wait on the write lock held by get_db()
+    connections."""
+    async with request.app.state.read_pool.connection() as conn:
+        yield conn
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection):
+    """Run the block inside BEGIN IMMEDIATE ... COMMIT.
+
+    Taking the write lock up front makes reads done inside the block (stock
+    checks, existence checks) consistent with the writes that follow, and
+    avoids the SQLITE_BUSY a deferred transaction can hit when it upgrades
+    from reading to writing. Rolls back if the block raises."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# Tables and indexes, applied by init_db() when the schema version is behind
+SCHEMA_SQL = f"""
+BEGIN;
+
+-- Users table
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    phone_number TEXT,
+    gender TEXT,
+    city TEXT,
+    country TEXT,
+    zip_code TEXT,
+    full_address TEXT,
+    role TEXT NOT NULL,
+    password TEXT NOT NULL,
+    token TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Admins table
+CREATE TABLE IF NOT EXISTS admins (
+    admin_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    phone_number TEXT,
+    email TEXT UNIQUE NOT NULL,
+    date_of_birth DATE,
+    joining_date DATE NOT NULL,
+    national_id TEXT UNIQUE,
+    address TEXT,
+    password TEXT NOT NULL,
+    token TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Sellers table
+CREATE TABLE IF NOT EXISTS sellers (
+    seller_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER UNIQUE NOT NULL,
+    approved_by_admin_id INTEGER,
+    approval_date DATE,
+    is_approved BOOLEAN DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (approved_by_admin_id) REFERENCES admins(admin_id)
+);
+
+-- Customers table
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER UNIQUE NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- Shops table
+CREATE TABLE IF NOT EXISTS shops (
+    shop_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seller_id INTEGER NOT NULL,
+    shop_name TEXT NOT NULL,
+    description TEXT,
+    address TEXT,
+    contact_phone TEXT,
+    rating REAL DEFAULT 0.0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (seller_id) REFERENCES sellers(seller_id)
+);
+
+-- Categories table
+CREATE TABLE IF NOT EXISTS categories (
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_name TEXT NOT NULL,
+    image TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Products table
+CREATE TABLE IF NOT EXISTS products (
+    product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    shop_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    product_name TEXT NOT NULL,
+    description TEXT,
+    image TEXT,
+    price REAL NOT NULL,
+    unit_price REAL NOT NULL,
+    stock_quantity INTEGER DEFAULT 0,
+    product_status TEXT DEFAULT 'active',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (shop_id) REFERENCES shops(shop_id),
+    FOREIGN KEY (category_id) REFERENCES categories(category_id)
+);
+
+-- Cart items table
+CREATE TABLE IF NOT EXISTS cart_items (
+    cart_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    price_at_addition REAL NOT NULL,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id)
+);
+
+-- Orders table
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id INTEGER NOT NULL,
+    order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    total_amount REAL NOT NULL,
+    shipping_address TEXT NOT NULL,
+    payment_status TEXT DEFAULT 'pending',
+    delivery_status TEXT DEFAULT 'processing',
+    FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
+);
+
+-- Order details table
+CREATE TABLE IF NOT EXISTS order_details (
+    order_detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_price REAL NOT NULL,
+    discount REAL DEFAULT 0.0,
+    subtotal REAL NOT NULL,
+    FOREIGN KEY (order_id) REFERENCES orders(order_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id)
+);
+
+-- Payments table
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER UNIQUE NOT NULL,
+    customer_id INTEGER NOT NULL,
+    payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    amount REAL NOT NULL,
+    payment_method TEXT,
+    transaction_id TEXT UNIQUE,
+    transaction_status TEXT DEFAULT 'pending',
+    FOREIGN KEY (order_id) REFERENCES orders(order_id),
+    FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
+);
+
+-- Shipments table
+CREATE TABLE IF NOT EXISTS shipments (
+    shipment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER UNIQUE NOT NULL,
+    shipping_date DATE,
+    carrier_name TEXT,
+    tracking_number TEXT UNIQUE,
+    shipping_address TEXT NOT NULL,
+    delivery_status TEXT DEFAULT 'preparing',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (order_id) REFERENCES orders(order_id)
+);
+
+-- Indexes for the hot lookups. sellers.user_id and customers.user_id are
+-- UNIQUE and therefore already indexed.
+-- The token columns are no longer written now that tokens are signed
+DROP INDEX IF EXISTS idx_users_token;
+DROP INDEX IF EXISTS idx_admins_token;
+-- One cart row per product: the unique index is the conflict target of the
+-- add_to_cart upsert and also serves customer_id-only lookups. Duplicate
+-- rows are merged into the oldest one before it is built.
+DROP INDEX IF EXISTS idx_cart_customer;
+DROP INDEX IF EXISTS idx_cart_customer_product;
+UPDATE cart_items
+SET quantity = (
+    SELECT SUM(dup.quantity) FROM cart_items dup
+    WHERE dup.customer_id = cart_items.customer_id
+      AND dup.product_id = cart_items.product_id
+)
+WHERE cart_item_id IN (
+    SELECT MIN(cart_item_id) FROM cart_items
+    GROUP BY customer_id, product_id HAVING COUNT(*) > 1
+);
+DELETE FROM cart_items
+WHERE cart_item_id NOT IN (
+    SELECT MIN(cart_item_id) FROM cart_items GROUP BY customer_id, product_id
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_customer_product
+    ON cart_items(customer_id, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_shop_cat
+    ON products(shop_id, category_id, product_status);
+-- order_id breaks ties between orders placed in the same second, so the
+-- paginated order history can be read in index order without a sort
+DROP INDEX IF EXISTS idx_orders_customer;
+CREATE INDEX idx_orders_customer
+    ON orders(customer_id, order_date DESC, order_id DESC);
+CREATE INDEX IF NOT EXISTS idx_order_details_order ON order_details(order_id);
+CREATE INDEX IF NOT EXISTS idx_shops_seller ON shops(seller_id);
+-- Category filters and the per-category counts in delete_category and
+-- delete_product cannot use idx_products_shop_cat, which leads with shop_id
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id);
+-- Reverse lookups done by delete_product
+CREATE INDEX IF NOT EXISTS idx_order_details_product ON order_details(product_id);
+CREATE INDEX IF NOT EXISTS idx_cart_product ON cart_items(product_id);
+-- Only unapproved sellers are indexed, so the pending-sellers listing reads a
+-- tiny index that also covers the join key
+CREATE INDEX IF NOT EXISTS idx_sellers_pending ON sellers(user_id)
+    WHERE is_approved = 0;
+
+-- Refresh planner statistics so the indexes above get picked
+ANALYZE;
+
+PRAGMA user_version = {SCHEMA_VERSION};
+COMMIT;
+"""
+
+
 def init_db():
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            phone_number TEXT,
-            gender TEXT,
-            city TEXT,
-            country TEXT,
-            zip_code TEXT,
-            full_address TEXT,
-            role TEXT NOT NULL,
-            password TEXT NOT NULL,
-            token TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Admins table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS admins (
-            admin_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            phone_number TEXT,
-            email TEXT UNIQUE NOT NULL,
-            date_of_birth DATE,
-            joining_date DATE NOT NULL,
-            national_id TEXT UNIQUE,
-            address TEXT,
-            password TEXT NOT NULL,
-            token TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Sellers table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sellers (
-            seller_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            approved_by_admin_id INTEGER,
-            approval_date DATE,
-            is_approved BOOLEAN DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users(user_id),
-            FOREIGN KEY (approved_by_admin_id) REFERENCES admins(admin_id)
-        )
-    """)
-
-    # Customers table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS customers (
-            customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-    """)
-
-    # Shops table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS shops (
-            shop_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            seller_id INTEGER NOT NULL,
-            shop_name TEXT NOT NULL,
-            description TEXT,
-            address TEXT,
-            contact_phone TEXT,
-            rating REAL DEFAULT 0.0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (seller_id) REFERENCES sellers(seller_id)
-        )
-    """)
-
-    # Categories table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS categories (
-            category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category_name TEXT NOT NULL,
-            image TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = ".".join(map(str, MIN_SQLITE_VERSION))
+        raise RuntimeError(
+            f"SQLite {required} or newer is required, found {sqlite3.sqlite_version}"
         )
-    """)
-
-    # Products table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            shop_id INTEGER NOT NULL,
-            category_id INTEGER NOT NULL,
-            product_name TEXT NOT NULL,
-            description TEXT,
-            image TEXT,
-            price REAL NOT NULL,
-            unit_price REAL NOT NULL,
-            stock_quantity INTEGER DEFAULT 0,
-            product_status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (shop_id) REFERENCES shops(shop_id),
-            FOREIGN KEY (category_id) REFERENCES categories(category_id)
-        )
-    """)
-
-    # Cart items table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS cart_items (
-            cart_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL DEFAULT 1,
-            price_at_addition REAL NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
-            FOREIGN KEY (product_id) REFERENCES products(product_id)
-        )
-    """)
-
-    # Orders table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_id INTEGER NOT NULL,
-            order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            total_amount REAL NOT NULL,
-            shipping_address TEXT NOT NULL,
-            payment_status TEXT DEFAULT 'pending',
-            delivery_status TEXT DEFAULT 'processing',
-            FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
-        )
-    """)
-
-    # Order details table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS order_details (
-            order_detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL,
-            unit_price REAL NOT NULL,
-            discount REAL DEFAULT 0.0,
-            subtotal REAL NOT NULL,
-            FOREIGN KEY (order_id) REFERENCES orders(order_id),
-            FOREIGN KEY (product_id) REFERENCES products(product_id)
-        )
-    """)
-
-    # Payments table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS payments (
-            payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER UNIQUE NOT NULL,
-            customer_id INTEGER NOT NULL,
-            payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            amount REAL NOT NULL,
-            payment_method TEXT,
-            transaction_id TEXT UNIQUE,
-            transaction_status TEXT DEFAULT 'pending',
-            FOREIGN KEY (order_id) REFERENCES orders(order_id),
-            FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
-        )
-    """)
-
-    # Shipments table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS shipments (
-            shipment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER UNIQUE NOT NULL,
-            shipping_date DATE,
-            carrier_name TEXT,
-            tracking_number TEXT UNIQUE,
-            shipping_address TEXT NOT NULL,
-            delivery_status TEXT DEFAULT 'preparing',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (order_id) REFERENCES orders(order_id)
-        )
-    """)
 
-    conn.commit()
+    conn = open_connection(DB_NAME)
+    # WAL lets readers run alongside the writer and avoids the double fsync
+    # of the rollback journal on every commit
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    # The schema is already current; skip re-running every CREATE ... IF NOT EXISTS
+    version = conn.execute("PRAGMA user_version").fetchone()["user_version"]
+    if version >= SCHEMA_VERSION:
+        conn.close()
+        return
+
+    # Parse and run the whole schema as one script inside a single transaction
+    conn.executescript(SCHEMA_SQL)
     conn.close()
 
 
 # --- Utility Functions ---
 
 
-def hash_password(password: str) -> str:
+# Both run bcrypt on the given executor and await it, so the event loop and
+# AnyIO's worker threads stay free while a hash is computed
+async def hash_password(password: str, executor: ThreadPoolExecutor) -> str:
     password_bytes = password.encode("utf-8")
-    hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    loop = asyncio.get_running_loop()
+    hashed = await loop.run_in_executor(executor, bcrypt.hashpw, password_bytes, salt)
     return hashed.decode("utf-8")
 
 
-def generate_token() -> str:
-    return secrets.token_hex(32)
+async def verify_password(
+    password: str, hashed: str, executor: ThreadPoolExecutor
+) -> bool:
+    # checkpw re-derives the hash with the stored salt and compares the
+    # digests in constant time
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8")
+    )
+
+
+# Checked against when no account matches the email, so unknown and known
+# emails take the same bcrypt time to reject
+DUMMY_PASSWORD_HASH = bcrypt.hashpw(
+    b"dummy-password", bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+).decode("utf-8")
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    # Strict: characters outside the URL-safe alphabet and non-canonical
+    # spellings raise ValueError, so every token has a single valid encoding
+    decoded = base64.b64decode(
+        data + "=" * (-len(data) % 4), altchars=b"-_", validate=True
+    )
+    if _b64encode(decoded) != data:
+        raise ValueError("non-canonical base64url")
+    return decoded
+
+
+# Only tokens carrying exactly this header are accepted, which pins the algorithm
+JWT_HEADER = _b64encode(b'{"alg":"HS256","typ":"JWT"}')
+
+
+def _sign(signing_input: str) -> bytes:
+    return hmac.new(SECRET_KEY, signing_input.encode("ascii"), hashlib.sha256).digest()
+
+
+def create_token(claims: Dict[str, Any]) -> str:
+    """Issue a signed token carrying `claims` plus expiry and a unique id."""
+    now = int(time.time())
+    payload = dict(claims, iat=now, exp=now + TOKEN_TTL, jti=secrets.token_urlsafe(12))
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    signing_input = f"{JWT_HEADER}.{body}"
+    return f"{signing_input}.{_b64encode(_sign(signing_input))}"
+
+
+def decode_token(token: str, scope: str) -> Optional[Dict[str, Any]]:
+    """Return the claims of a valid, unexpired, unrevoked token issued for
+    `scope`, or None."""
+    try:
+        signing_input, signature = token.rsplit(".", 1)
+        header, body = signing_input.split(".")
+        if header != JWT_HEADER or not hmac.compare_digest(
+            _b64decode(signature), _sign(signing_input)
+        ):
+            return None
+        claims = json.loads(_b64decode(body))
+    except ValueError:
+        return None
+
+    if claims["scope"] != scope or claims["exp"] < time.time():
+        return None
+    if claims["jti"] in revoked_tokens:
+        return None
+    return claims
+
+
+class RevokedTokens:
+    """Thread-safe set of logged-out token ids. Each id is only kept until
+    the token it belongs to would have expired anyway.
+
+    The set lives in this process only: a logout is not seen by other worker
+    processes and is forgotten on restart, after which the token is accepted
+    again until it expires (at most TOKEN_TTL seconds)."""
+
+    def __init__(self):
+        self._ids: set = set()
+        self._expiry_heap: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def add(self, jti: str, expires_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._ids.add(jti)
+            heapq.heappush(self._expiry_heap, (expires_at, jti))
+            while self._expiry_heap and self._expiry_heap[0][0] < now:
+                self._ids.discard(heapq.heappop(self._expiry_heap)[1])
+
+    def __contains__(self, jti: str) -> bool:
+        with self._lock:
+            return jti in self._ids
+
+
+revoked_tokens = RevokedTokens()
 
 
 # --- Dependency Functions ---
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-) -> Dict[str, Any]:
-    token = credentials.credentials
-    conn = get_db()
-    cursor = conn.cursor()
+class BearerToken(HTTPBearer):
+    """HTTPBearer that hands back the raw token string, parsed with a single
+    prefix check instead of building an HTTPAuthorizationCredentials."""
 
-    user = cursor.execute("SELECT * FROM users WHERE token = ?", (token,)).fetchone()
+    async def __call__(self, request: Request) -> str:
+        authorization = request.headers.get("authorization", "")
+        if authorization[:7].lower() != "bearer " or not authorization[7:]:
+            raise self.make_not_authenticated_error()
+        return authorization[7:]
 
-    conn.close()
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid authentication")
+# Keeps the scheme name HTTPBearer so the OpenAPI docs are unchanged
+security = BearerToken(scheme_name="HTTPBearer")
 
-    return dict(user)
 
+# Token checks are pure CPU work, so they run on the event loop rather than
+# costing a worker-thread hop on every request
+async def get_current_user(token: str = Depends(security)) -> Dict[str, Any]:
+    claims = decode_token(token, "user")
 
-def get_current_admin(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-) -> Dict[str, Any]:
-    token = credentials.credentials
-    conn = get_db()
-    cursor = conn.cursor()
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid authentication")
 
-    admin = cursor.execute("SELECT * FROM admins WHERE token = ?", (token,)).fetchone()
+    return claims
 
-    conn.close()
 
-    if not admin:
+async def get_current_admin(token: str = Depends(security)) -> Dict[str, Any]:
+    claims = decode_token(token, "admin")
+
+    if claims is None:
         raise HTTPException(status_code=401, detail="Admin authentication required")
 
-    return dict(admin)
+    return claims
 
 
 # --- FastAPI Application ---
 
-app = FastAPI()
-
 
-# Initialize database on startup
-@app.on_event("startup")
-def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the database and open the long-lived resources kept on
+    app.state for the lifetime of the process."""
+    if not SECRET_KEY:
+        raise RuntimeError(
+            "SECRET_KEY is not set; set it to the same random value for every "
+            "worker process, e.g. the output of "
+            'python -c "import secrets; print(secrets.token_hex(32))"'
+        )
     init_db()
+    app.state.pool = ConnectionPool(DB_NAME, DB_POOL_SIZE)
+    app.state.read_pool = ConnectionPool(DB_NAME, DB_READ_POOL_SIZE, read_only=True)
+    app.state.hash_executor = ThreadPoolExecutor(
+        max_workers=HASH_WORKERS, thread_name_prefix="bcrypt"
+    )
+    if THREADPOOL_SIZE:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        limiter.total_tokens = int(THREADPOOL_SIZE)
+    try:
+        yield
+    finally:
+        app.state.pool.close()
+        app.state.read_pool.close()
+        app.state.hash_executor.shutdown()
+
+
+# Serialize responses with orjson. List endpoints return ORJSONResponse
+# directly: their rows are already plain dicts of JSON-native values, so the
+# per-row jsonable_encoder pass FastAPI would otherwise run is skipped.
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 # --- Authentication Endpoints ---
 
 
-@app.post("/users/register")
-def register_user(user: UserRegister):
-    """Register a new user (customer or seller)"""
-    conn = get_db()
-    cursor = conn.cursor()
+# The auth handlers below are async: they await bcrypt on the hash executor
+# and only borrow a pooled connection around the short SQL, which runs in
+# these helpers on a worker thread. Registration hashes before borrowing and
+# login returns the connection before checking the password, so a burst of
+# either never holds the pool while bcrypt runs.
 
-    # Check if email exists
-    existing = cursor.execute(
-        "SELECT * FROM users WHERE email = ?", (user.email,)
-    ).fetchone()
-    if existing:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Email already registered")
 
-    # Create user
-    hashed_pw = hash_password(user.password)
-    cursor.execute(
-        """
-        INSERT INTO users (name, email, password, phone_number, gender, city, country,
-                           zip_code, full_address, role)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            user.name,
-            user.email,
-            hashed_pw,
-            user.phone_number,
-            user.gender,
-            user.city,
-            user.country,
-            user.zip_code,
-            user.full_address,
-            user.role,
-        ),
-    )
+def _create_user(conn: sqlite3.Connection, user: UserRegister, hashed_pw: str) -> int:
+    # The email check, the user row and its role row are committed together
+    with write_transaction(conn):
+        # Check if email exists
+        existing = conn.execute(
+            "SELECT 1 FROM users WHERE email = ?", (user.email,)
+        ).fetchone()
+        if existing:
+            raise HTTPException(status_code=400, detail="Email already registered")
 
-    user_id = cursor.lastrowid
+        # Create user
+        user_id = conn.execute(
+            """
+            INSERT INTO users (name, email, password, phone_number, gender, city, country,
+                               zip_code, full_address, role)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING user_id
+        """,
+            (
+                user.name,
+                user.email,
+                hashed_pw,
+                user.phone_number,
+                user.gender,
+                user.city,
+                user.country,
+                user.zip_code,
+                user.full_address,
+                user.role,
+            ),
+        ).fetchone()["user_id"]
 
-    # Create role-specific record
-    if user.role == UserRole.CUSTOMER:
-        cursor.execute("INSERT INTO customers (user_id) VALUES (?)", (user_id,))
-    elif user.role == UserRole.SELLER:
-        cursor.execute("INSERT INTO sellers (user_id) VALUES (?)", (user_id,))
+        # Create role-specific record
+        if user.role == UserRole.CUSTOMER:
+            conn.execute("INSERT INTO customers (user_id) VALUES (?)", (user_id,))
+        elif user.role == UserRole.SELLER:
+            conn.execute("INSERT INTO sellers (user_id) VALUES (?)", (user_id,))
 
-    conn.commit()
-    conn.close()
+    return user_id
 
-    return {"message": "User registered successfully", "user_id": user_id}
 
+@app.post("/users/register")
+async def register_user(user: UserRegister, request: Request):
+    """Register a new user (customer or seller)"""
+    hashed_pw = await hash_password(user.password, request.app.state.hash_executor)
+    async with request.app.state.pool.connection() as conn:
+        user_id = await run_in_threadpool(_create_user, conn, user, hashed_pw)
+
+    return {"message": "User registered successfully", "user_id": user_id}
 
-@app.post("/users/login")
-def login_user(credentials: UserLogin):
-    """Login user and get authentication token"""
-    conn = get_db()
-    cursor = conn.cursor()
 
-    user = cursor.execute(
-        "SELECT * FROM users WHERE email = ?",
-        (credentials.email,),
+def _find_user(conn: sqlite3.Connection, email: str) -> Optional[Dict[str, Any]]:
+    return conn.execute(
+        """
+        SELECT u.user_id, u.role, u.password, c.customer_id, s.seller_id
+        FROM users u
+        LEFT JOIN customers c ON c.user_id = u.user_id
+        LEFT JOIN sellers s ON s.user_id = u.user_id
+        WHERE u.email = ?
+    """,
+        (email,),
     ).fetchone()
 
-    if not user:
-        conn.close()
-        raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    password_valid = bcrypt.checkpw(
-        credentials.password.encode("utf-8"), user["password"].encode("utf-8")
-    )
+@app.post("/users/login")
+async def login_user(credentials: UserLogin, request: Request):
+    """Login user and get authentication token"""
+    async with request.app.state.read_pool.connection() as conn:
+        user = await run_in_threadpool(_find_user, conn, credentials.email)
 
-    if not password_valid:
-        conn.close()
+    hashed = user["password"] if user else DUMMY_PASSWORD_HASH
+    executor = request.app.state.hash_executor
+    if not await verify_password(credentials.password, hashed, executor) or not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    # Generate and save token
-    token = generate_token()
-    cursor.execute(
-        "UPDATE users SET token = ? WHERE user_id = ?", (token, user["user_id"])
+    # The profile ids never change after registration, so handlers can take
+    # them straight from the token
+    token = create_token(
+        {
+            "scope": "user",
+            "user_id": user["user_id"],
+            "role": user["role"],
+            "customer_id": user["customer_id"],
+            "seller_id": user["seller_id"],
+        }
     )
-    conn.commit()
-    conn.close()
 
     return {
         "message": "Login successful",
@@ -483,94 +832,102 @@ def login_user(credentials: UserLogin):
     }
 
 
+@app.post("/users/logout")
+def logout_user(current_user: dict = Depends(get_current_user)):
+    """Logout user and revoke the authentication token"""
+    revoked_tokens.add(current_user["jti"], current_user["exp"])
+
+    return {"message": "Logout successful"}
+
+
 @app.get("/users/profile")
-def get_user_profile(current_user: dict = Depends(get_current_user)):
+def get_user_profile(
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
     """Get current user's profile"""
-    # The current_user dictionary already contains user details
-    # We might want to exclude sensitive fields like password and token
-    user_profile = {
-        k: v for k, v in current_user.items() if k not in ["password", "token"]
-    }
+    # Authentication only loads a few columns, so read the full profile here,
+    # leaving out sensitive fields like password and token
+    user_profile = conn.execute(
+        """
+        SELECT user_id, name, email, phone_number, gender, city, country,
+               zip_code, full_address, role, created_at
+        FROM users
+        WHERE user_id = ?
+    """,
+        (current_user["user_id"],),
+    ).fetchone()
     return user_profile
 
 
 # --- Admin Endpoints ---
 
 
-@app.post("/admins/register")
-def register_admin(admin: AdminCreate):
-    """Register a new admin"""
-    conn = get_db()
-    cursor = conn.cursor()
+def _create_admin(conn: sqlite3.Connection, admin: AdminCreate, hashed_pw: str) -> int:
+    with write_transaction(conn):
+        # Check if email or national_id exists
+        existing_email = conn.execute(
+            "SELECT 1 FROM admins WHERE email = ?", (admin.email,)
+        ).fetchone()
+        if existing_email:
+            raise HTTPException(status_code=400, detail="Email already registered")
+        existing_national_id = conn.execute(
+            "SELECT 1 FROM admins WHERE national_id = ?", (admin.national_id,)
+        ).fetchone()
+        if existing_national_id:
+            raise HTTPException(
+                status_code=400, detail="National ID already registered"
+            )
 
-    # Check if email or national_id exists
-    existing_email = cursor.execute(
-        "SELECT * FROM admins WHERE email = ?", (admin.email,)
-    ).fetchone()
-    if existing_email:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Email already registered")
-    existing_national_id = cursor.execute(
-        "SELECT * FROM admins WHERE national_id = ?", (admin.national_id,)
-    ).fetchone()
-    if existing_national_id:
-        conn.close()
-        raise HTTPException(status_code=400, detail="National ID already registered")
+        admin_id = conn.execute(
+            """
+            INSERT INTO admins (name, email, password, phone_number, date_of_birth, joining_date, national_id, address)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING admin_id
+        """,
+            (
+                admin.name,
+                admin.email,
+                hashed_pw,
+                admin.phone_number,
+                admin.date_of_birth,
+                admin.joining_date,
+                admin.national_id,
+                admin.address,
+            ),
+        ).fetchone()["admin_id"]
 
-    hashed_pw = hash_password(admin.password)
-    cursor.execute(
-        """
-        INSERT INTO admins (name, email, password, phone_number, date_of_birth, joining_date, national_id, address)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            admin.name,
-            admin.email,
-            hashed_pw,
-            admin.phone_number,
-            admin.date_of_birth,
-            admin.joining_date,
-            admin.national_id,
-            admin.address,
-        ),
-    )
+    return admin_id
 
-    admin_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
 
-    return {"message": "Admin registered successfully", "admin_id": admin_id}
+@app.post("/admins/register")
+async def register_admin(admin: AdminCreate, request: Request):
+    """Register a new admin"""
+    hashed_pw = await hash_password(admin.password, request.app.state.hash_executor)
+    async with request.app.state.pool.connection() as conn:
+        admin_id = await run_in_threadpool(_create_admin, conn, admin, hashed_pw)
 
+    return {"message": "Admin registered successfully", "admin_id": admin_id}
 
-@app.post("/admins/login")
-def login_admin(credentials: UserLogin):
-    """Admin login"""
-    conn = get_db()
-    cursor = conn.cursor()
 
-    admin = cursor.execute(
-        "SELECT * FROM admins WHERE email = ?",
-        (credentials.email,),
+def _find_admin(conn: sqlite3.Connection, email: str) -> Optional[Dict[str, Any]]:
+    return conn.execute(
+        "SELECT admin_id, password FROM admins WHERE email = ?", (email,)
     ).fetchone()
 
-    if not admin:
-        conn.close()
-        raise HTTPException(status_code=401, detail="Invalid admin credentials")
 
-    password_valid = bcrypt.checkpw(
-        credentials.password.encode("utf-8"), admin["password"].encode("utf-8")
-    )
+@app.post("/admins/login")
+async def login_admin(credentials: UserLogin, request: Request):
+    """Admin login"""
+    async with request.app.state.read_pool.connection() as conn:
+        admin = await run_in_threadpool(_find_admin, conn, credentials.email)
 
-    if not password_valid:
-        conn.close()
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    hashed = admin["password"] if admin else DUMMY_PASSWORD_HASH
+    executor = request.app.state.hash_executor
+    if not await verify_password(credentials.password, hashed, executor) or not admin:
+        raise HTTPException(status_code=401, detail="Invalid admin credentials")
 
-    token = generate_token()
-    cursor.execute(
-        "UPDATE admins SET token = ? WHERE admin_id = ?", (token, admin["admin_id"])
-    )
-    conn.commit()
-    conn.close()
+    token = create_token({"scope": "admin", "admin_id": admin["admin_id"]})
 
     return {
         "message": "Admin login successful",
@@ -579,44 +936,49 @@ def login_admin(credentials: UserLogin):
     }
 
 
+@app.post("/admins/logout")
+def logout_admin(current_admin: dict = Depends(get_current_admin)):
+    """Admin logout"""
+    revoked_tokens.add(current_admin["jti"], current_admin["exp"])
+
+    return {"message": "Admin logout successful"}
+
+
 @app.get("/admins/pending-sellers")
-def get_pending_sellers(current_admin: dict = Depends(get_current_admin)):
+def get_pending_sellers(
+    current_admin: dict = Depends(get_current_admin),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
     """Get all sellers pending approval"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    sellers = cursor.execute("""
-        SELECT s.seller_id, s.user_id, u.name, u.email, u.phone_number
+    sellers = conn.execute("""
+        SELECT s.seller_id, u.name, u.email, u.phone_number
         FROM sellers s
         JOIN users u ON s.user_id = u.user_id
         WHERE s.is_approved = 0
     """).fetchall()
 
-    conn.close()
-    return [dict(seller) for seller in sellers]
+    return ORJSONResponse(sellers)
 
 
 @app.put("/admins/sellers/{seller_id}/approve")
-def approve_seller(seller_id: int, current_admin: dict = Depends(get_current_admin)):
+def approve_seller(
+    seller_id: int,
+    current_admin: dict = Depends(get_current_admin),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     """Approve a seller"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        UPDATE sellers
-        SET is_approved = 1, approved_by_admin_id = ?, approval_date = ?
-        WHERE seller_id = ?
-    """,
-        (current_admin["admin_id"], date.today(), seller_id),
-    )
-
-    if cursor.rowcount == 0:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Seller not found")
+    with write_transaction(conn):
+        cursor = conn.execute(
+            """
+            UPDATE sellers
+            SET is_approved = 1, approved_by_admin_id = ?, approval_date = ?
+            WHERE seller_id = ?
+        """,
+            (current_admin["admin_id"], date.today(), seller_id),
+        )
 
-    conn.commit()
-    conn.close()
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Seller not found")
 
     return {"message": "Seller approved successfully"}
 
@@ -626,28 +988,25 @@ def approve_seller(seller_id: int, current_admin: dict = Depends(get_current_adm
 
 @app.post("/categories")
 def create_category(
-    category: CategoryCreate, current_admin: dict = Depends(get_current_admin)
+    category: CategoryCreate,
+    current_admin: dict = Depends(get_current_admin),
+    conn: sqlite3.Connection = Depends(get_db),
 ):
     """Create a new category (Admin only)"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Check if category name already exists
-    existing_category = cursor.execute(
-        "SELECT * FROM categories WHERE category_name = ?", (category.category_name,)
-    ).fetchone()
-    if existing_category:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Category name already exists")
-
-    cursor.execute(
-        "INSERT INTO categories (category_name, image) VALUES (?, ?)",
-        (category.category_name, category.image),
-    )
+    with write_transaction(conn):
+        # Check if category name already exists
+        existing_category = conn.execute(
+            "SELECT 1 FROM categories WHERE category_name = ?",
+            (category.category_name,),
+        ).fetchone()
+        if existing_category:
+            raise HTTPException(status_code=400, detail="Category name already exists")
 
-    category_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        category_id = conn.execute(
+            "INSERT INTO categories (category_name, image) VALUES (?, ?)"
+            " RETURNING category_id",
+            (category.category_name, category.image),
+        ).fetchone()["category_id"]
 
     return {"message": "Category created", "category_id": category_id}
 
@@ -657,18 +1016,15 @@ def update_category(
     category_id: int,
     category_update: CategoryUpdate,
     current_admin: dict = Depends(get_current_admin),
+    conn: sqlite3.Connection = Depends(get_db),
 ):
     """Update category details (Admin only)"""
-    conn = get_db()
-    cursor = conn.cursor()
-
     # Check if category exists
-    existing_category = cursor.execute(
-        "SELECT * FROM categories WHERE category_id = ?", (category_id,)
+    existing_category = conn.execute(
+        "SELECT category_name FROM categories WHERE category_id = ?", (category_id,)
     ).fetchone()
 
     if not existing_category:
-        conn.close()
         raise HTTPException(status_code=404, detail="Category not found")
 
     # Check if the new category name already exists (and is not the current one)
@@ -676,132 +1032,119 @@ def update_category(
         category_update.category_name is not None
         and category_update.category_name != existing_category["category_name"]
     ):
-        existing_with_new_name = cursor.execute(
-            "SELECT * FROM categories WHERE category_name = ?",
+        existing_with_new_name = conn.execute(
+            "SELECT 1 FROM categories WHERE category_name = ?",
             (category_update.category_name,),
         ).fetchone()
         if existing_with_new_name:
-            conn.close()
             raise HTTPException(status_code=400, detail="Category name already exists")
 
-    update_fields = []
-    update_values = []
-
-    if category_update.category_name is not None:
-        update_fields.append("category_name = ?")
-        update_values.append(category_update.category_name)
-    if category_update.image is not None:
-        update_fields.append("image = ?")
-        update_values.append(category_update.image)
+    # Only the fields sent with a value are updated
+    updates = category_update.model_dump(mode="json", exclude_none=True)
 
-    if not update_fields:
-        conn.close()
+    if not updates:
         raise HTTPException(status_code=400, detail="No fields to update")
 
-    set_clause = ", ".join(update_fields)
-    query = f"UPDATE categories SET {set_clause} WHERE category_id = ?"
-    update_values.append(category_id)
-
-    cursor.execute(query, tuple(update_values))
+    set_clause = ", ".join(CATEGORY_UPDATE_SQL[field] for field in updates)
+    conn.execute(
+        f"UPDATE categories SET {set_clause} WHERE category_id = ?",
+        (*updates.values(), category_id),
+    )
     conn.commit()
-    conn.close()
 
     return {"message": "Category updated successfully", "category_id": category_id}
 
 
 @app.delete("/categories/{category_id}")
-def delete_category(category_id: int, current_admin: dict = Depends(get_current_admin)):
+def delete_category(
+    category_id: int,
+    current_admin: dict = Depends(get_current_admin),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     """Delete a category (Admin only), preventing deletion if products are associated with it."""
-    conn = get_db()
-    cursor = conn.cursor()
-
     # Check if category exists
-    existing_category = cursor.execute(
-        "SELECT * FROM categories WHERE category_id = ?", (category_id,)
+    existing_category = conn.execute(
+        "SELECT 1 FROM categories WHERE category_id = ?", (category_id,)
     ).fetchone()
 
     if not existing_category:
-        conn.close()
         raise HTTPException(status_code=404, detail="Category not found")
 
     # Check for associated products
-    product_count = cursor.execute(
-        "SELECT COUNT(*) FROM products WHERE category_id = ?", (category_id,)
-    ).fetchone()[0]
+    has_products = conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM products WHERE category_id = ?) AS found",
+        (category_id,),
+    ).fetchone()["found"]
 
-    if product_count > 0:
-        conn.close()
+    if has_products:
         raise HTTPException(
             status_code=400,
             detail="Cannot delete category: products are associated with it. Please reassign or delete products first.",
         )
 
-    cursor.execute("DELETE FROM categories WHERE category_id = ?", (category_id,))
+    conn.execute("DELETE FROM categories WHERE category_id = ?", (category_id,))
     conn.commit()
-    conn.close()
 
     return {"message": "Category deleted successfully", "category_id": category_id}
 
 
 @app.get("/categories")
-def get_categories():
+def get_categories(conn: sqlite3.Connection = Depends(get_read_db)):
     """Get all categories"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    categories = cursor.execute("SELECT * FROM categories").fetchall()
-    conn.close()
+    categories = conn.execute("SELECT * FROM categories").fetchall()
 
-    return [dict(cat) for cat in categories]
+    return ORJSONResponse(categories)
 
 
 # --- Shop Endpoints ---
 
 
 @app.post("/shops")
-def create_shop(shop: ShopCreate, current_user: dict = Depends(get_current_user)):
+def create_shop(
+    shop: ShopCreate,
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     """Create a shop (Seller only)"""
     if current_user["role"] != "seller":
         raise HTTPException(status_code=403, detail="Only sellers can create shops")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Get seller_id
-    seller = cursor.execute(
-        "SELECT seller_id, is_approved FROM sellers WHERE user_id = ?",
-        (current_user["user_id"],),
-    ).fetchone()
+    seller_id = current_user["seller_id"]
+    with write_transaction(conn):
+        # Approval can change at any time, so it is read fresh rather than
+        # taken from the token; the existing-shop check rides along
+        seller = conn.execute(
+            """
+            SELECT s.is_approved,
+                   EXISTS (SELECT 1 FROM shops WHERE seller_id = s.seller_id) AS has_shop
+            FROM sellers s
+            WHERE s.seller_id = ?
+        """,
+            (seller_id,),
+        ).fetchone()
 
-    if not seller or not seller["is_approved"]:
-        conn.close()
-        raise HTTPException(status_code=403, detail="Seller must be approved by admin")
+        if not seller or not seller["is_approved"]:
+            raise HTTPException(
+                status_code=403, detail="Seller must be approved by admin"
+            )
 
-    # Check if seller already has a shop
-    existing_shop = cursor.execute(
-        "SELECT * FROM shops WHERE seller_id = ?", (seller["seller_id"],)
-    ).fetchone()
-    if existing_shop:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Seller already has a shop.")
+        if seller["has_shop"]:
+            raise HTTPException(status_code=400, detail="Seller already has a shop.")
 
-    cursor.execute(
-        """
-        INSERT INTO shops (seller_id, shop_name, description, address, contact_phone)
-        VALUES (?, ?, ?, ?, ?)
-    """,
-        (
-            seller["seller_id"],
-            shop.shop_name,
-            shop.description,
-            shop.address,
-            shop.contact_phone,
-        ),
-    )
-
-    shop_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        shop_id = conn.execute(
+            """
+            INSERT INTO shops (seller_id, shop_name, description, address, contact_phone)
+            VALUES (?, ?, ?, ?, ?)
+            RETURNING shop_id
+        """,
+            (
+                seller_id,
+                shop.shop_name,
+                shop.description,
+                shop.address,
+                shop.contact_phone,
+            ),
+        ).fetchone()["shop_id"]
 
     return {"message": "Shop created successfully", "shop_id": shop_id}
 
@@ -811,118 +1154,89 @@ def update_shop(
     shop_id: int,
     shop_update: ShopCreate,  # Reusing ShopCreate for update fields
     current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
 ):
     """Update shop details (Seller only)"""
     if current_user["role"] != "seller":
         raise HTTPException(status_code=403, detail="Only sellers can update shops")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
     # Verify shop ownership
-    seller = cursor.execute(
-        "SELECT seller_id FROM sellers WHERE user_id = ?", (current_user["user_id"],)
-    ).fetchone()
+    seller_id = current_user["seller_id"]
 
-    if not seller:
-        conn.close()
+    if seller_id is None:
         raise HTTPException(status_code=403, detail="Seller not found")
 
     # Check if the shop belongs to the seller
-    shop = cursor.execute(
-        "SELECT * FROM shops WHERE shop_id = ? AND seller_id = ?",
-        (shop_id, seller["seller_id"]),
+    shop = conn.execute(
+        "SELECT 1 FROM shops WHERE shop_id = ? AND seller_id = ?",
+        (shop_id, seller_id),
     ).fetchone()
 
     if not shop:
-        conn.close()
         raise HTTPException(
             status_code=404, detail="Shop not found or not owned by seller"
         )
 
-    update_fields = []
-    update_values = []
-
-    if shop_update.shop_name is not None:
-        update_fields.append("shop_name = ?")
-        update_values.append(shop_update.shop_name)
-    if shop_update.description is not None:
-        update_fields.append("description = ?")
-        update_values.append(shop_update.description)
-    if shop_update.address is not None:
-        update_fields.append("address = ?")
-        update_values.append(shop_update.address)
-    if shop_update.contact_phone is not None:
-        update_fields.append("contact_phone = ?")
-        update_values.append(shop_update.contact_phone)
-
-    if not update_fields:
-        conn.close()
-        raise HTTPException(status_code=400, detail="No fields to update")
+    # Only the fields sent with a value are updated
+    updates = shop_update.model_dump(mode="json", exclude_none=True)
 
-    set_clause = ", ".join(update_fields)
-    query = f"UPDATE shops SET {set_clause} WHERE shop_id = ?"
-    update_values.append(shop_id)
+    if not updates:
+        raise HTTPException(status_code=400, detail="No fields to update")
 
-    cursor.execute(query, tuple(update_values))
+    set_clause = ", ".join(SHOP_UPDATE_SQL[field] for field in updates)
+    conn.execute(
+        f"UPDATE shops SET {set_clause} WHERE shop_id = ?",
+        (*updates.values(), shop_id),
+    )
     conn.commit()
-    conn.close()
 
     return {"message": "Shop updated successfully", "shop_id": shop_id}
 
 
 @app.get("/shops/my-shops")
-def get_my_shops(current_user: dict = Depends(get_current_user)):
+def get_my_shops(
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
     """Get seller's shops"""
     if current_user["role"] != "seller":
         raise HTTPException(status_code=403, detail="Only sellers can view their shops")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    seller = cursor.execute(
-        "SELECT seller_id FROM sellers WHERE user_id = ?", (current_user["user_id"],)
-    ).fetchone()
+    seller_id = current_user["seller_id"]
 
-    if not seller:
-        conn.close()
+    if seller_id is None:
         raise HTTPException(status_code=404, detail="Seller profile not found.")
 
-    shops = cursor.execute(
-        "SELECT * FROM shops WHERE seller_id = ?", (seller["seller_id"],)
+    shops = conn.execute(
+        "SELECT * FROM shops WHERE seller_id = ?", (seller_id,)
     ).fetchall()
 
-    conn.close()
-    return [dict(shop) for shop in shops]
+    return ORJSONResponse(shops)
 
 
 @app.get("/shops/all")  # Changed from get_all_shops to /shops/all for clarity
-def get_all_shops():
-    """Get all shops"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    shops = cursor.execute("SELECT * FROM shops").fetchall()
-    conn.close()
+def get_all_shops(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
+    """Get all shops (paginated)"""
+    shops = conn.execute(
+        "SELECT * FROM shops ORDER BY shop_id LIMIT ? OFFSET ?", (limit, offset)
+    ).fetchall()
 
-    return [dict(shop) for shop in shops]
+    return ORJSONResponse(shops)
 
 
 @app.get("/shops/{shop_id}")
-def get_shop_details(shop_id: int):
+def get_shop_details(shop_id: int, conn: sqlite3.Connection = Depends(get_read_db)):
     """Get details of a specific shop"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    shop = cursor.execute(
-        "SELECT * FROM shops WHERE shop_id = ?", (shop_id,)
-    ).fetchone()
-    conn.close()
+    shop = conn.execute("SELECT * FROM shops WHERE shop_id = ?", (shop_id,)).fetchone()
 
     if not shop:
         raise HTTPException(status_code=404, detail="Shop not found")
 
-    return dict(shop)
+    return shop
 
 
 # --- Product Endpoints ---
@@ -930,65 +1244,62 @@ def get_shop_details(shop_id: int):
 
 @app.post("/products")
 def create_product(
-    product: ProductCreate, current_user: dict = Depends(get_current_user)
+    product: ProductCreate,
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
 ):
     """Create a product (Seller only)"""
     if current_user["role"] != "seller":
         raise HTTPException(status_code=403, detail="Only sellers can create products")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
     # Verify shop ownership
-    seller = cursor.execute(
-        "SELECT seller_id FROM sellers WHERE user_id = ?", (current_user["user_id"],)
-    ).fetchone()
+    seller_id = current_user["seller_id"]
 
-    if not seller:
-        conn.close()
+    if seller_id is None:
         raise HTTPException(status_code=403, detail="Seller profile not found.")
 
-    shop = cursor.execute(
-        "SELECT * FROM shops WHERE shop_id = ? AND seller_id = ?",
-        (product.shop_id, seller["seller_id"]),
-    ).fetchone()
-
-    if not shop:
-        conn.close()
-        raise HTTPException(
-            status_code=403, detail="Shop not found or not owned by seller"
-        )
+    with write_transaction(conn):
+        # Check shop ownership and the category in one round trip
+        checks = conn.execute(
+            """
+            SELECT
+                EXISTS (
+                    SELECT 1 FROM shops WHERE shop_id = ? AND seller_id = ?
+                ) AS owns_shop,
+                EXISTS (
+                    SELECT 1 FROM categories WHERE category_id = ?
+                ) AS category_exists
+        """,
+            (product.shop_id, seller_id, product.category_id),
+        ).fetchone()
 
-    # Verify category exists
-    category = cursor.execute(
-        "SELECT * FROM categories WHERE category_id = ?", (product.category_id,)
-    ).fetchone()
-    if not category:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Category not found")
+        if not checks["owns_shop"]:
+            raise HTTPException(
+                status_code=403, detail="Shop not found or not owned by seller"
+            )
 
-    cursor.execute(
-        """
-        INSERT INTO products (shop_id, category_id, product_name, description, image,
-                            price, unit_price, stock_quantity, product_status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            product.shop_id,
-            product.category_id,
-            product.product_name,
-            product.description,
-            product.image,
-            product.price,
-            product.unit_price,
-            product.stock_quantity,
-            product.product_status,
-        ),
-    )
+        if not checks["category_exists"]:
+            raise HTTPException(status_code=404, detail="Category not found")
 
-    product_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        product_id = conn.execute(
+            """
+            INSERT INTO products (shop_id, category_id, product_name, description, image,
+                                price, unit_price, stock_quantity, product_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING product_id
+        """,
+            (
+                product.shop_id,
+                product.category_id,
+                product.product_name,
+                product.description,
+                product.image,
+                product.price,
+                product.unit_price,
+                product.stock_quantity,
+                product.product_status,
+            ),
+        ).fetchone()["product_id"]
 
     return {"message": "Product created successfully", "product_id": product_id}
 
@@ -998,158 +1309,135 @@ def update_product(
     product_id: int,
     product_update: ProductUpdate,
     current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
 ):
     """Update a product (Seller only)"""
     if current_user["role"] != "seller":
         raise HTTPException(status_code=403, detail="Only sellers can update products")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    seller = cursor.execute(
-        "SELECT seller_id FROM sellers WHERE user_id = ?", (current_user["user_id"],)
-    ).fetchone()
+    seller_id = current_user["seller_id"]
 
-    if not seller:
-        conn.close()
+    if seller_id is None:
         raise HTTPException(status_code=403, detail="Seller not found")
 
     # Check if the product exists and belongs to the seller's shop
-    product = cursor.execute(
+    product = conn.execute(
         "SELECT p.product_id, p.category_id, p.shop_id FROM products p JOIN shops s ON p.shop_id = s.shop_id WHERE p.product_id = ? AND s.seller_id = ?",
-        (product_id, seller["seller_id"]),
+        (product_id, seller_id),
     ).fetchone()
 
     if not product:
-        conn.close()
         raise HTTPException(
             status_code=404, detail="Product not found or not owned by seller"
         )
 
-    # Construct update query dynamically
-    update_fields = []
-    update_values = []
-
-    if product_update.product_name is not None:
-        update_fields.append("product_name = ?")
-        update_values.append(product_update.product_name)
-    if product_update.description is not None:
-        update_fields.append("description = ?")
-        update_values.append(product_update.description)
-    if product_update.image is not None:
-        update_fields.append("image = ?")
-        update_values.append(product_update.image)
-    if product_update.price is not None:
-        update_fields.append("price = ?")
-        update_values.append(product_update.price)
-    if product_update.unit_price is not None:
-        update_fields.append("unit_price = ?")
-        update_values.append(product_update.unit_price)
-    if product_update.stock_quantity is not None:
-        update_fields.append("stock_quantity = ?")
-        update_values.append(product_update.stock_quantity)
-    if product_update.product_status is not None:
-        update_fields.append("product_status = ?")
-        update_values.append(product_update.product_status.value)
-
-    if not update_fields:
-        conn.close()
-        raise HTTPException(status_code=400, detail="No fields to update")
+    # Only the fields sent with a value are updated
+    updates = product_update.model_dump(mode="json", exclude_none=True)
 
-    set_clause = ", ".join(update_fields)
-    query = f"UPDATE products SET {set_clause} WHERE product_id = ?"
-    update_values.append(product_id)
+    if not updates:
+        raise HTTPException(status_code=400, detail="No fields to update")
 
-    cursor.execute(query, tuple(update_values))
+    set_clause = ", ".join(PRODUCT_UPDATE_SQL[field] for field in updates)
+    conn.execute(
+        f"UPDATE products SET {set_clause} WHERE product_id = ?",
+        (*updates.values(), product_id),
+    )
     conn.commit()
-    conn.close()
 
     return {"message": "Product updated successfully", "product_id": product_id}
 
 
 @app.delete("/products/{product_id}")
-def delete_product(product_id: int, current_user: dict = Depends(get_current_user)):
+def delete_product(
+    product_id: int,
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     """Delete a product (Seller only), preventing deletion if it's the last product in its category."""
     if current_user["role"] != "seller":
         raise HTTPException(status_code=403, detail="Only sellers can delete products")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    seller = cursor.execute(
-        "SELECT seller_id FROM sellers WHERE user_id = ?", (current_user["user_id"],)
-    ).fetchone()
+    seller_id = current_user["seller_id"]
 
-    if not seller:
-        conn.close()
+    if seller_id is None:
         raise HTTPException(status_code=403, detail="Seller not found")
 
-    # Get product details and verify ownership
-    product = cursor.execute(
-        "SELECT p.product_id, p.category_id FROM products p JOIN shops s ON p.shop_id = s.shop_id WHERE p.product_id = ? AND s.seller_id = ?",
-        (product_id, seller["seller_id"]),
-    ).fetchone()
-
-    if not product:
-        conn.close()
-        raise HTTPException(
-            status_code=404, detail="Product not found or not owned by seller"
-        )
+    with write_transaction(conn):
+        # Ownership and both deletion guards in one query
+        product = conn.execute(
+            """
+            SELECT
+                EXISTS (
+                    SELECT 1 FROM products other
+                    WHERE other.category_id = p.category_id
+                      AND other.product_id != p.product_id
+                ) AS has_other_products,
+                EXISTS (
+                    SELECT 1 FROM order_details WHERE product_id = p.product_id
+                ) AS in_orders
+            FROM products p
+            JOIN shops s ON p.shop_id = s.shop_id
+            WHERE p.product_id = ? AND s.seller_id = ?
+        """,
+            (product_id, seller_id),
+        ).fetchone()
 
-    category_id = product["category_id"]
+        if not product:
+            raise HTTPException(
+                status_code=404, detail="Product not found or not owned by seller"
+            )
 
-    # Check if this is the last product in its category
-    product_count_in_category = cursor.execute(
-        "SELECT COUNT(*) FROM products WHERE category_id = ?", (category_id,)
-    ).fetchone()[0]
+        # Each category must keep at least one product
+        if not product["has_other_products"]:
+            raise HTTPException(
+                status_code=400,
+                detail="Cannot delete the last product in a category. Each category must have at least one product.",
+            )
 
-    if product_count_in_category == 1:
-        conn.close()
-        raise HTTPException(
-            status_code=400,
-            detail="Cannot delete the last product in a category. Each category must have at least one product.",
-        )
+        # Products referenced by orders are kept to avoid orphaned order details
+        if product["in_orders"]:
+            raise HTTPException(
+                status_code=400,
+                detail="Cannot delete product: it is part of existing orders. Please consider deactivating the product instead.",
+            )
 
-    # Before deleting, check for related order details to prevent orphaned data
-    order_details_count = cursor.execute(
-        "SELECT COUNT(*) FROM order_details WHERE product_id = ?", (product_id,)
-    ).fetchone()[0]
+        # Remove the product from any carts; a no-op when it is in none
+        conn.execute("DELETE FROM cart_items WHERE product_id = ?", (product_id,))
 
-    if order_details_count > 0:
-        # Option 1: Prevent deletion and inform the user
-        conn.close()
-        raise HTTPException(
-            status_code=400,
-            detail="Cannot delete product: it is part of existing orders. Please consider deactivating the product instead.",
-        )
-        # Option 2: Soft delete (e.g., update product_status to 'inactive' or 'discontinued')
-        # This would require modifying the product schema and this endpoint logic.
-        # For now, we enforce strict deletion prevention.
-
-    # Also check for cart items
-    cart_items_count = cursor.execute(
-        "SELECT COUNT(*) FROM cart_items WHERE product_id = ?", (product_id,)
-    ).fetchone()[0]
-    if cart_items_count > 0:
-        # Remove from cart if product is deleted
-        cursor.execute("DELETE FROM cart_items WHERE product_id = ?", (product_id,))
-
-    cursor.execute("DELETE FROM products WHERE product_id = ?", (product_id,))
-    conn.commit()
-    conn.close()
+        conn.execute("DELETE FROM products WHERE product_id = ?", (product_id,))
 
     return {"message": "Product deleted successfully", "product_id": product_id}
 
 
 @app.get("/products")
-def get_products(category_id: Optional[int] = None, shop_id: Optional[int] = None):
-    """Browse all products with optional filters"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    query = "SELECT p.*, s.shop_name FROM products p JOIN shops s ON p.shop_id = s.shop_id WHERE p.product_status = 'active'"
+def get_products(
+    category_id: Optional[int] = None,
+    shop_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[int] = Query(None, ge=1),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
+    """Browse all products with optional filters (paginated, newest first).
+
+    Pass the last product_id of a page as cursor to fetch the next one; it
+    seeks on the primary key instead of skipping offset rows."""
+    # The listing leaves out the free-text description, which is returned by
+    # GET /products/{product_id}
+    query = """
+        SELECT p.product_id, p.shop_id, p.category_id, p.product_name, p.image,
+               p.price, p.unit_price, p.stock_quantity, p.product_status,
+               p.created_at, s.shop_name
+        FROM products p
+        JOIN shops s ON p.shop_id = s.shop_id
+        WHERE p.product_status = 'active'
+    """
     params = []
 
+    if cursor:
+        query += " AND p.product_id < ?"
+        params.append(cursor)
+
     if category_id:
         query += " AND p.category_id = ?"
         params.append(category_id)
@@ -1158,172 +1446,150 @@ def get_products(category_id: Optional[int] = None, shop_id: Optional[int] = Non
         query += " AND p.shop_id = ?"
         params.append(shop_id)
 
-    products = cursor.execute(query, params).fetchall()
-    conn.close()
+    query += " ORDER BY p.product_id DESC LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+
+    products = conn.execute(query, params).fetchall()
 
-    return [dict(product) for product in products]
+    return ORJSONResponse(products)
 
 
 @app.get("/products/{product_id}")
-def get_product(product_id: int):
+def get_product(product_id: int, conn: sqlite3.Connection = Depends(get_read_db)):
     """Get product details"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    product = cursor.execute(
-        "SELECT p.*, s.shop_name FROM products p JOIN shops s ON p.shop_id = s.shop_id WHERE p.product_id = ?",
+    product = conn.execute(
+        """
+        SELECT p.product_id, p.shop_id, p.category_id, p.product_name,
+               p.description, p.image, p.price, p.unit_price, p.stock_quantity,
+               p.product_status, p.created_at, s.shop_name
+        FROM products p
+        JOIN shops s ON p.shop_id = s.shop_id
+        WHERE p.product_id = ?
+    """,
         (product_id,),
     ).fetchone()
-    conn.close()
 
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    return dict(product)
+    return product
 
 
 # --- Cart Endpoints ---
 
 
 @app.post("/cart")
-def add_to_cart(item: CartItemAdd, current_user: dict = Depends(get_current_user)):
+def add_to_cart(
+    item: CartItemAdd,
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     """Add product to cart"""
     if current_user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers can add to cart")
 
-    conn = get_db()
-    cursor = conn.cursor()
+    customer_id = current_user["customer_id"]
 
-    # Get customer_id
-    customer = cursor.execute(
-        "SELECT customer_id FROM customers WHERE user_id = ?",
-        (current_user["user_id"],),
-    ).fetchone()
-
-    if not customer:
-        conn.close()
+    if customer_id is None:
         raise HTTPException(status_code=404, detail="Customer profile not found.")
 
-    # Get product details (check if product exists and is active)
-    product = cursor.execute(
-        "SELECT price, stock_quantity, product_status FROM products WHERE product_id = ?",
-        (item.product_id,),
-    ).fetchone()
-
-    if not product:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Product not found")
-
-    if product["product_status"] != ProductStatus.ACTIVE.value:
-        conn.close()
-        raise HTTPException(
-            status_code=400,
-            detail=f"Product is not available. Status: {product['product_status']}",
-        )
-
     if item.quantity <= 0:
         raise HTTPException(status_code=400, detail="Quantity must be positive.")
 
-    if item.quantity > product["stock_quantity"]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Requested quantity ({item.quantity}) exceeds available stock ({product['stock_quantity']}).",
-        )
+    # The stock checks and the cart write see the same snapshot
+    with write_transaction(conn):
+        # Get product details (check if product exists and is active)
+        product = conn.execute(
+            "SELECT price, stock_quantity, product_status FROM products WHERE product_id = ?",
+            (item.product_id,),
+        ).fetchone()
 
-    # Check if item already exists in cart, if so, update quantity
-    existing_cart_item = cursor.execute(
-        "SELECT * FROM cart_items WHERE customer_id = ? AND product_id = ?",
-        (customer["customer_id"], item.product_id),
-    ).fetchone()
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
 
-    if existing_cart_item:
-        new_quantity = existing_cart_item["quantity"] + item.quantity
-        if new_quantity > product["stock_quantity"]:
+        if product["product_status"] != ProductStatus.ACTIVE.value:
             raise HTTPException(
                 status_code=400,
-                detail=f"Requested quantity ({new_quantity}) exceeds available stock ({product['stock_quantity']}).",
+                detail=f"Product is not available. Status: {product['product_status']}",
             )
-        cursor.execute(
-            "UPDATE cart_items SET quantity = ? WHERE cart_item_id = ?",
-            (new_quantity, existing_cart_item["cart_item_id"]),
-        )
-    else:
-        cursor.execute(
+
+        if item.quantity > product["stock_quantity"]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Requested quantity ({item.quantity}) exceeds available stock ({product['stock_quantity']}).",
+            )
+
+        # Insert the item or add to the quantity already in the cart in one
+        # statement; the transaction is rolled back if the total is too high
+        new_quantity = conn.execute(
             """
             INSERT INTO cart_items (customer_id, product_id, quantity, price_at_addition)
             VALUES (?, ?, ?, ?)
+            ON CONFLICT (customer_id, product_id)
+            DO UPDATE SET quantity = quantity + excluded.quantity
+            RETURNING quantity
         """,
-            (customer["customer_id"], item.product_id, item.quantity, product["price"]),
-        )
+            (customer_id, item.product_id, item.quantity, product["price"]),
+        ).fetchone()["quantity"]
 
-    conn.commit()
-    conn.close()
+        if new_quantity > product["stock_quantity"]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Requested quantity ({new_quantity}) exceeds available stock ({product['stock_quantity']}).",
+            )
 
     return {"message": "Product added to cart"}
 
 
 @app.get("/cart")
-def get_cart(current_user: dict = Depends(get_current_user)):
-    """Get customer's cart"""
+def get_cart(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
+    """Get customer's cart (paginated)"""
     if current_user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers have carts")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    customer = cursor.execute(
-        "SELECT customer_id FROM customers WHERE user_id = ?",
-        (current_user["user_id"],),
-    ).fetchone()
-
-    if not customer:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Customer profile not found.")
-
-    cart_items = cursor.execute(
+    cart_items = conn.execute(
         """
         SELECT ci.cart_item_id, ci.product_id, p.product_name, p.image, ci.quantity, ci.price_at_addition, (ci.quantity * ci.price_at_addition) as subtotal
         FROM cart_items ci
         JOIN products p ON ci.product_id = p.product_id
         WHERE ci.customer_id = ?
+        ORDER BY ci.cart_item_id
+        LIMIT ? OFFSET ?
     """,
-        (customer["customer_id"],),
+        (current_user["customer_id"], limit, offset),
     ).fetchall()
-    conn.close()
 
-    return [dict(item) for item in cart_items]
+    return ORJSONResponse(cart_items)
 
 
 @app.delete("/cart/{cart_item_id}")
-def remove_from_cart(cart_item_id: int, current_user: dict = Depends(get_current_user)):
+def remove_from_cart(
+    cart_item_id: int,
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     """Remove item from cart"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    customer = cursor.execute(
-        "SELECT customer_id FROM customers WHERE user_id = ?",
-        (current_user["user_id"],),
-    ).fetchone()
-
-    if not customer:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Customer profile not found.")
-
-    # Check if cart item belongs to the customer
-    cart_item = cursor.execute(
-        "SELECT * FROM cart_items WHERE cart_item_id = ? AND customer_id = ?",
-        (cart_item_id, customer["customer_id"]),
-    ).fetchone()
+    # Only deletes the item if it belongs to the current customer
+    cursor = conn.execute(
+        """
+        DELETE FROM cart_items
+        WHERE cart_item_id = ?
+          AND customer_id = ?
+    """,
+        (cart_item_id, current_user["customer_id"]),
+    )
 
-    if not cart_item:
-        conn.close()
+    if cursor.rowcount == 0:
         raise HTTPException(
             status_code=404, detail="Cart item not found or does not belong to you."
         )
 
-    cursor.execute("DELETE FROM cart_items WHERE cart_item_id = ?", (cart_item_id,))
     conn.commit()
-    conn.close()
 
     return {"message": "Item removed from cart"}
 
@@ -1332,139 +1598,130 @@ def remove_from_cart(cart_item_id: int, current_user: dict = Depends(get_current
 
 
 @app.post("/checkout")
-def checkout(order_data: OrderCreate, current_user: dict = Depends(get_current_user)):
+def checkout(
+    order_data: OrderCreate,
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     """Checkout and create order from cart"""
     if current_user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers can place orders")
 
-    conn = get_db()
-    cursor = conn.cursor()
+    customer_id = current_user["customer_id"]
 
-    customer = cursor.execute(
-        "SELECT customer_id FROM customers WHERE user_id = ?",
-        (current_user["user_id"],),
-    ).fetchone()
-
-    if not customer:
-        conn.close()
+    if customer_id is None:
         raise HTTPException(status_code=404, detail="Customer profile not found.")
 
-    # Get cart items and validate stock before proceeding
-    cart_items = cursor.execute(
-        """
-        SELECT ci.cart_item_id, ci.product_id, ci.quantity, ci.price_at_addition, p.stock_quantity, p.product_status
-        FROM cart_items ci
-        JOIN products p ON ci.product_id = p.product_id
-        WHERE ci.customer_id = ?
-    """,
-        (customer["customer_id"],),
-    ).fetchall()
+    # Lock out other writers until the order is complete so the stock that
+    # is validated here cannot change before it is decremented
+    with write_transaction(conn):
+        total_amount = conn.execute(
+            """
+            SELECT SUM(price_at_addition * quantity) AS total
+            FROM cart_items
+            WHERE customer_id = ?
+        """,
+            (customer_id,),
+        ).fetchone()["total"]
 
-    if not cart_items:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Cart is empty")
+        if total_amount is None:
+            raise HTTPException(status_code=400, detail="Cart is empty")
 
-    total_amount = 0
-    products_to_update_stock = []
+        # Only cart items that cannot be fulfilled come back from this query
+        item = conn.execute(
+            """
+            SELECT ci.product_id, ci.quantity, p.stock_quantity, p.product_status
+            FROM cart_items ci
+            JOIN products p ON ci.product_id = p.product_id
+            WHERE ci.customer_id = ?
+              AND (p.product_status != ? OR ci.quantity > p.stock_quantity)
+            LIMIT 1
+        """,
+            (customer_id, ProductStatus.ACTIVE.value),
+        ).fetchone()
 
-    for item in cart_items:
-        if item["product_status"] != ProductStatus.ACTIVE.value:
-            conn.close()
-            raise HTTPException(
-                status_code=400,
-                detail=f"Product '{item['product_id']}' is not available.",
-            )
-        if item["quantity"] > item["stock_quantity"]:
-            conn.close()
+        if item:
+            if item["product_status"] != ProductStatus.ACTIVE.value:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Product '{item['product_id']}' is not available.",
+                )
             raise HTTPException(
                 status_code=400,
                 detail=f"Product '{item['product_id']}' has insufficient stock. Requested: {item['quantity']}, Available: {item['stock_quantity']}.",
             )
 
-        subtotal = item["price_at_addition"] * item["quantity"]
-        total_amount += subtotal
-        products_to_update_stock.append(
-            {
-                "product_id": item["product_id"],
-                "quantity_ordered": item["quantity"],
-                "new_stock_quantity": item["stock_quantity"] - item["quantity"],
-            }
+        # Create order
+        order_id = conn.execute(
+            """
+            INSERT INTO orders (customer_id, total_amount, shipping_address)
+            VALUES (?, ?, ?)
+            RETURNING order_id
+        """,
+            (customer_id, total_amount, order_data.shipping_address),
+        ).fetchone()["order_id"]
+
+        # Copy the cart lines into order details without leaving SQLite
+        conn.execute(
+            """
+            INSERT INTO order_details (order_id, product_id, quantity, unit_price, subtotal)
+            SELECT ?, product_id, quantity, price_at_addition, price_at_addition * quantity
+            FROM cart_items
+            WHERE customer_id = ?
+        """,
+            (order_id, customer_id),
         )
 
-    # Create order
-    cursor.execute(
-        """
-        INSERT INTO orders (customer_id, total_amount, shipping_address)
-        VALUES (?, ?, ?)
-    """,
-        (customer["customer_id"], total_amount, order_data.shipping_address),
-    )
+        # Decrement stock for every ordered product in one statement, marking
+        # products that sell out as out of stock. Cart rows are unique per
+        # product, so each product joins exactly one row.
+        conn.execute(
+            """
+            UPDATE products
+            SET stock_quantity = products.stock_quantity - c.quantity,
+                product_status = CASE
+                    WHEN products.stock_quantity = c.quantity THEN ?
+                    ELSE products.product_status
+                END
+            FROM cart_items AS c
+            WHERE c.customer_id = ? AND products.product_id = c.product_id
+        """,
+            (ProductStatus.OUT_OF_STOCK.value, customer_id),
+        )
 
-    order_id = cursor.lastrowid
+        # One read from the OS RNG covers both ids: 8 bytes for the
+        # transaction id and 6 for the tracking number
+        random_hex = secrets.token_hex(14).upper()
+        transaction_id = f"TXN{random_hex[:16]}"
+        tracking_number = f"TRACK{random_hex[16:]}"
 
-    # Create order details and update stock
-    for item in cart_items:
-        subtotal = item["price_at_addition"] * item["quantity"]
-        cursor.execute(
+        # Create payment
+        conn.execute(
             """
-            INSERT INTO order_details (order_id, product_id, quantity, unit_price, subtotal)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO payments (order_id, customer_id, amount, payment_method, transaction_id, transaction_status)
+            VALUES (?, ?, ?, ?, ?, ?)
         """,
             (
                 order_id,
-                item["product_id"],
-                item["quantity"],
-                item["price_at_addition"],
-                subtotal,
+                customer_id,
+                total_amount,
+                order_data.payment_method,
+                transaction_id,
+                PaymentStatus.COMPLETED.value,
             ),
-        )
+        )  # Assuming payment is completed upon checkout
 
-    for update_info in products_to_update_stock:
-        cursor.execute(
-            "UPDATE products SET stock_quantity = ? WHERE product_id = ?",
-            (update_info["new_stock_quantity"], update_info["product_id"]),
+        # Create shipment
+        conn.execute(
+            """
+            INSERT INTO shipments (order_id, shipping_address, tracking_number)
+            VALUES (?, ?, ?)
+        """,
+            (order_id, order_data.shipping_address, tracking_number),
         )
-        # Update product status if stock reaches zero
-        if update_info["new_stock_quantity"] == 0:
-            cursor.execute(
-                "UPDATE products SET product_status = ? WHERE product_id = ?",
-                (ProductStatus.OUT_OF_STOCK.value, update_info["product_id"]),
-            )
-
-    # Create payment
-    transaction_id = f"TXN{secrets.token_hex(8).upper()}"
-    cursor.execute(
-        """
-        INSERT INTO payments (order_id, customer_id, amount, payment_method, transaction_id, transaction_status)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """,
-        (
-            order_id,
-            customer["customer_id"],
-            total_amount,
-            order_data.payment_method,
-            transaction_id,
-            PaymentStatus.COMPLETED.value,
-        ),
-    )  # Assuming payment is completed upon checkout
-
-    # Create shipment
-    tracking_number = f"TRACK{secrets.token_hex(6).upper()}"
-    cursor.execute(
-        """
-        INSERT INTO shipments (order_id, shipping_address, tracking_number)
-        VALUES (?, ?, ?)
-    """,
-        (order_id, order_data.shipping_address, tracking_number),
-    )
-
-    # Clear cart
-    cursor.execute(
-        "DELETE FROM cart_items WHERE customer_id = ?", (customer["customer_id"],)
-    )
 
-    conn.commit()
-    conn.close()
+        # Clear cart
+        conn.execute("DELETE FROM cart_items WHERE customer_id = ?", (customer_id,))
 
     return {
         "message": "Order placed successfully",
@@ -1475,24 +1732,17 @@ def checkout(order_data: OrderCreate, current_user: dict = Depends(get_current_u
 
 
 @app.get("/orders/my")  # Changed from get_my_orders to /orders/my
-def get_my_orders(current_user: dict = Depends(get_current_user)):
-    """Get customer's orders"""
+def get_my_orders(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
+    """Get customer's orders (paginated, newest first)"""
     if current_user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers have orders")
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    customer = cursor.execute(
-        "SELECT customer_id FROM customers WHERE user_id = ?",
-        (current_user["user_id"],),
-    ).fetchone()
-
-    if not customer:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Customer profile not found.")
-
-    orders = cursor.execute(
+    orders = conn.execute(
         """
         SELECT o.order_id, o.order_date, o.total_amount, o.payment_status, o.delivery_status,
                p.transaction_id, s.tracking_number
@@ -1500,71 +1750,94 @@ def get_my_orders(current_user: dict = Depends(get_current_user)):
         LEFT JOIN payments p ON o.order_id = p.order_id
         LEFT JOIN shipments s ON o.order_id = s.order_id
         WHERE o.customer_id = ?
-        ORDER BY o.order_date DESC
+        ORDER BY o.order_date DESC, o.order_id DESC
+        LIMIT ? OFFSET ?
     """,
-        (customer["customer_id"],),
+        (current_user["customer_id"], limit, offset),
     ).fetchall()
-    conn.close()
 
-    return [dict(order) for order in orders]
+    return ORJSONResponse(orders)
 
 
 @app.get("/orders/{order_id}")
-def get_order_details(order_id: int, current_user: dict = Depends(get_current_user)):
+def get_order_details(
+    order_id: int,
+    current_user: dict = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_read_db),
+):
     """Get order details"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Fetch order and check if it belongs to the current user
-    order = cursor.execute(
-        "SELECT * FROM orders WHERE order_id = ?", (order_id,)
-    ).fetchone()
-
-    if not order:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    # Ensure the order belongs to the current customer
-    if (
-        order["customer_id"] != current_user["customer_id"]
-    ):  # This assumes current_user dict has 'customer_id' if role is customer
-        # Need to fetch customer_id if not directly available in current_user or add it to get_current_user logic
-        customer_check = cursor.execute(
-            "SELECT customer_id FROM customers WHERE user_id = ?",
-            (current_user["user_id"],),
-        ).fetchone()
-        if not customer_check or order["customer_id"] != customer_check["customer_id"]:
-            conn.close()
-            raise HTTPException(
-                status_code=403, detail="You can only view your own orders."
-            )
-        # If it belongs to the customer, we can proceed.
-
-    order_items = cursor.execute(
+    # Order, line items, payment, shipment and the ownership check in one
+    # statement; the nested parts come back as JSON documents
+    row = conn.execute(
         """
-        SELECT od.order_detail_id, od.product_id, p.product_name, p.image, od.quantity, od.unit_price, od.discount, od.subtotal
-        FROM order_details od
-        JOIN products p ON od.product_id = p.product_id
-        WHERE od.order_id = ?
+        SELECT
+            json_object(
+                'order_id', o.order_id, 'customer_id', o.customer_id,
+                'order_date', o.order_date, 'total_amount', o.total_amount,
+                'shipping_address', o.shipping_address,
+                'payment_status', o.payment_status,
+                'delivery_status', o.delivery_status
+            ) AS order_json,
+            (
+                SELECT json_group_array(json_object(
+                    'order_detail_id', od.order_detail_id,
+                    'product_id', od.product_id, 'product_name', p.product_name,
+                    'image', p.image, 'quantity', od.quantity,
+                    'unit_price', od.unit_price, 'discount', od.discount,
+                    'subtotal', od.subtotal
+                ))
+                FROM order_details od
+                JOIN products p ON od.product_id = p.product_id
+                WHERE od.order_id = o.order_id
+            ) AS items_json,
+            (
+                SELECT json_object(
+                    'payment_id', pay.payment_id, 'order_id', pay.order_id,
+                    'customer_id', pay.customer_id,
+                    'payment_date', pay.payment_date, 'amount', pay.amount,
+                    'payment_method', pay.payment_method,
+                    'transaction_id', pay.transaction_id,
+                    'transaction_status', pay.transaction_status
+                )
+                FROM payments pay
+                WHERE pay.order_id = o.order_id
+            ) AS payment_json,
+            (
+                SELECT json_object(
+                    'shipment_id', sh.shipment_id, 'order_id', sh.order_id,
+                    'shipping_date', sh.shipping_date,
+                    'carrier_name', sh.carrier_name,
+                    'tracking_number', sh.tracking_number,
+                    'shipping_address', sh.shipping_address,
+                    'delivery_status', sh.delivery_status,
+                    'created_at', sh.created_at
+                )
+                FROM shipments sh
+                WHERE sh.order_id = o.order_id
+            ) AS shipment_json,
+            o.customer_id = ? AS is_owner
+        FROM orders o
+        WHERE o.order_id = ?
     """,
-        (order_id,),
-    ).fetchall()
-
-    payment = cursor.execute(
-        "SELECT * FROM payments WHERE order_id = ?", (order_id,)
+        (current_user["customer_id"], order_id),
     ).fetchone()
 
-    shipment = cursor.execute(
-        "SELECT * FROM shipments WHERE order_id = ?", (order_id,)
-    ).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Order not found")
 
-    conn.close()
+    # Ensure the order belongs to the current customer
+    if not row["is_owner"]:
+        raise HTTPException(
+            status_code=403, detail="You can only view your own orders."
+        )
 
     return {
-        "order": dict(order),
-        "items": [dict(item) for item in order_items],
-        "payment": dict(payment) if payment else None,
-        "shipment": dict(shipment) if shipment else None,
+        "order": json.loads(row["order_json"]),
+        "items": json.loads(row["items_json"]),
+        "payment": json.loads(row["payment_json"]) if row["payment_json"] else None,
+        "shipment": (
+            json.loads(row["shipment_json"]) if row["shipment_json"] else None
+        ),
     }
 
 